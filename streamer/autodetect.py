@@ -14,75 +14,338 @@
 
 """A module to contain auto-detection logic; based on ffprobe."""
 
+import collections
+import concurrent.futures
+import functools
+import json
+import os
 import shlex
+import shutil
 import subprocess
+import tempfile
+import threading
 import time
 
 from streamer.bitrate_configuration import VideoResolution, VideoResolutionName
-from streamer.input_configuration import Input, InputType
-from typing import Optional, List
+from streamer.input_configuration import Input, InputType, MediaType
+from typing import Any, Dict, Iterable, List, Optional
 
 # These cannot be probed by ffprobe.
 TYPES_WE_CANT_PROBE = [
   InputType.EXTERNAL_COMMAND,
 ]
 
+# These are plain files, whose probe results can be cached as long as the file
+# itself does not change.
+TYPES_WE_CAN_CACHE = [
+  InputType.FILE,
+  InputType.LOOPED_FILE,
+]
+
+# The maximum number of files whose probe results are kept in the disk cache.
+# The least recently used entries are dropped beyond this.
+DISK_CACHE_MAX_ENTRIES = 1024
+
+# Probe results for plain files, persisted across runs, loaded on first use.
+# Maps '<absolute path>|<size>|<mtime in ns>' to ffprobe's output.  None if not
+# loaded yet, or if the disk cache can't be used in this run.
+_disk_cache: Optional[Dict[str, Dict[str, Any]]] = None
+# Identifies the ffprobe binary and entries used to produce the disk cache.
+# A cache file with any other version is discarded.
+_disk_cache_version: Optional[str] = None
+# True once we have tried to load the disk cache.
+_disk_cache_loaded = False
+# True if results have been added to the disk cache since it was last written.
+_disk_cache_dirty = False
+# Guards the disk cache, which can be used from several threads by prefetch().
+_disk_cache_lock = threading.Lock()
+
+# The entries requested from ffprobe, in the syntax of its -show_entries option.
+PROBED_ENTRIES = [
+  'stream=codec_type,r_frame_rate,width,height,field_order',
+  'stream_tags=language',
+]
 
-def _probe(input: Input, field: str) -> Optional[str]:
-  """Autodetect some feature of the input, if possible, using ffprobe.
+# Maps our media types to the codec_type values reported by ffprobe.
+CODEC_TYPES = {
+  MediaType.VIDEO: 'video',
+  MediaType.AUDIO: 'audio',
+  MediaType.TEXT: 'subtitle',
+}
+
+
+def _run_ffprobe(name: str, input_args: List[str]) -> Dict[str, Any]:
+  """Run ffprobe once on an input and return all of its metadata.
 
   Args:
-    input (Input): An input object from input_configuration.
-    field (str): A field to pass to ffprobe's -show_entries option.
+    name (str): The name of the input, as passed to ffprobe.
+    input_args (list): Any input arguments required to read this input.
 
   Returns:
-    The requested field from ffprobe as a string, or None if this fails.
+    The parsed JSON output of ffprobe, describing all streams of the input.
   """
 
-  if input.input_type in TYPES_WE_CANT_PROBE:
-    # Not supported for this type.
-    return None
-
   args: List[str] = [
       # Probe this input file
-      'ffprobe', input.name,
+      'ffprobe', name,
   ]
 
   # Add any required input arguments for this input type
-  args += input.get_input_args()
+  args += input_args
 
   args += [
-      # Specifically, this stream
-      '-select_streams', input.get_stream_specifier(),
-      # Show the needed metadata only
-      '-show_entries', field,
-      # Print the metadata in a compact form, which is easier to parse
-      '-of', 'compact=p=0:nk=1'
+      # Show the metadata needed by every autodetected field, for all streams,
+      # so that they can all be read from a single invocation
+      '-show_entries', ':'.join(PROBED_ENTRIES),
+      # Print the metadata as JSON, which can be parsed without any guesswork
+      # about delimiters.  The compact format, for example, can leave trailing
+      # "|" characters on some fields for some iPhone MOV files.
+      '-of', 'json',
   ]
 
   print('+ ' + ' '.join([shlex.quote(arg) for arg in args]))
 
   output_bytes: bytes = subprocess.check_output(args, stderr=subprocess.DEVNULL)
-  # The output is either the language code or just a blank line.
-  output_string: Optional[str] = output_bytes.decode('utf-8').strip()
-  # After stripping the newline, we can fall back to None if it's empty.
-  output_string = output_string or None
+  return json.loads(output_bytes.decode('utf-8'))
+
+def _get_disk_cache_path() -> str:
+  """Get the path to the disk cache, following the XDG base directory spec."""
+
+  cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                os.path.join(os.path.expanduser('~'), '.cache'))
+  return os.path.join(cache_home, 'shaka-streamer', 'ffprobe.json')
+
+def _get_disk_cache_version() -> Optional[str]:
+  """Get a version string for the contents of the disk cache.
+
+  This changes whenever the entries we request from ffprobe change, or the
+  ffprobe binary itself changes, since either can change the probe results.
+  The binary is identified by its path, size, and modification time, so that
+  no extra process is needed to check the version.
+
+  Returns None if ffprobe can't be found, in which case the disk cache should
+  not be used.
+  """
+
+  ffprobe_path = shutil.which('ffprobe')
+  if ffprobe_path is None:
+    return None
+
+  ffprobe_path = os.path.realpath(ffprobe_path)
+  try:
+    stat = os.stat(ffprobe_path)
+  except OSError:
+    return None
+
+  return '{}|{}|{} {}'.format(ffprobe_path, stat.st_size, stat.st_mtime_ns,
+                              ':'.join(PROBED_ENTRIES))
+
+def _get_disk_cache() -> Optional[Dict[str, Dict[str, Any]]]:
+  """Get the disk cache, loading it if necessary.
+
+  Must be called with _disk_cache_lock held.  A missing or unreadable cache
+  file, or one with a different version, is treated as an empty cache.  Returns
+  None if the disk cache can't be used in this run.
+  """
+
+  global _disk_cache, _disk_cache_version, _disk_cache_loaded
+  if not _disk_cache_loaded:
+    _disk_cache_loaded = True
+
+    version = _get_disk_cache_version()
+    if version is None:
+      return None
+
+    entries: Dict[str, Dict[str, Any]] = collections.OrderedDict()
+    try:
+      with open(_get_disk_cache_path(), 'r') as f:
+        contents = json.load(f, object_pairs_hook=collections.OrderedDict)
+      if (isinstance(contents, dict) and
+          contents.get('version') == version and
+          isinstance(contents.get('entries'), dict)):
+        entries = contents['entries']
+    except (OSError, ValueError):
+      pass
+
+    _disk_cache_version = version
+    _disk_cache = entries
+
+  return _disk_cache
+
+def _save_disk_cache() -> None:
+  """Atomically rewrite the disk cache file.
+
+  Must be called with _disk_cache_lock held.  Failures are ignored, since the
+  cache is only an optimization.
+  """
+
+  if _disk_cache is None or _disk_cache_version is None:
+    return
+
+  path = _get_disk_cache_path()
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump({
+          'version': _disk_cache_version,
+          'entries': _disk_cache,
+        }, f)
+      os.replace(temp_path, path)
+    finally:
+      # Only left behind if something went wrong before the rename.
+      if os.path.exists(temp_path):
+        os.unlink(temp_path)
+  except OSError:
+    pass
+
+def _flush_disk_cache() -> None:
+  """Write the disk cache, if any results have been added since the last
+  write."""
+
+  global _disk_cache_dirty
+  with _disk_cache_lock:
+    if _disk_cache_dirty:
+      _save_disk_cache()
+      _disk_cache_dirty = False
+
+@functools.lru_cache(maxsize=128)
+def _probe_file(path: str, size: int, mtime: int) -> Dict[str, Any]:
+  """Probe a plain file, caching the results in memory and on disk.
+
+  The file size and modification time are only used as part of the cache key,
+  so that a file which changes on disk will be probed again.  New results are
+  only written to disk by _flush_disk_cache().
+  """
+
+  global _disk_cache_dirty
+  key = '{}|{}|{}'.format(os.path.abspath(path), size, mtime)
+
+  with _disk_cache_lock:
+    disk_cache = _get_disk_cache()
+    if disk_cache is not None and key in disk_cache:
+      # Mark this entry as the most recently used.
+      disk_cache[key] = disk_cache.pop(key)
+      return disk_cache[key]
+
+  # Don't hold the lock while ffprobe runs, so that prefetch() can run several
+  # of these in parallel.
+  result = _run_ffprobe(path, [])
+
+  with _disk_cache_lock:
+    disk_cache = _get_disk_cache()
+    if disk_cache is not None:
+      disk_cache[key] = result
+      # Drop the least recently used entries, which come first.
+      while len(disk_cache) > DISK_CACHE_MAX_ENTRIES:
+        del disk_cache[next(iter(disk_cache))]
+      _disk_cache_dirty = True
+
+  return result
+
+def _probe_path(path: str) -> Optional[Dict[str, Any]]:
+  """Probe a plain file through the cache, or return None if it can't be
+  found."""
+
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  return _probe_file(path, stat.st_size, stat.st_mtime_ns)
+
+def prefetch(paths: Iterable[str]) -> None:
+  """Probe several plain files in parallel, ahead of time.
+
+  Most of the time spent probing is the startup of ffprobe itself, so this
+  allows an entire input config to be probed in roughly the time of a single
+  file.  The results go into the same cache used by probe().  Any failures are
+  ignored here, and will be reported when the input is probed again later.
+  """
+
+  unique_paths = set(paths)
+  if not unique_paths:
+    return
+
+  def try_probe(path: str) -> None:
+    try:
+      _probe_path(path)
+    except (subprocess.CalledProcessError, OSError, ValueError):
+      pass
+
+  max_workers = min(8, len(unique_paths))
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+    # Consume the results to wait for all of them to complete.
+    list(pool.map(try_probe, unique_paths))
+
+  # Write all the new results to disk at once.
+  _flush_disk_cache()
+
+def probe(input: Input) -> Optional[Dict[str, Any]]:
+  """Probe the input, if possible, using ffprobe.
+
+  The result can be passed to the get_* methods below, so that several fields
+  can be autodetected from a single run of ffprobe.
+
+  Args:
+    input (Input): An input object from input_configuration.
+
+  Returns:
+    The parsed JSON output of ffprobe, or None if this type can't be probed.
+  """
+
+  if input.input_type in TYPES_WE_CANT_PROBE:
+    # Not supported for this type.
+    return None
+
+  if input.input_type in TYPES_WE_CAN_CACHE:
+    result = _probe_path(input.name)
+    _flush_disk_cache()
+    if result is not None:
+      return result
+    # Otherwise, the file can't be found, so let ffprobe fail on this in the
+    # usual way.
+
+  result = _run_ffprobe(input.name, input.get_input_args())
 
   # Webcams on Linux seem to behave badly if the device is rapidly opened and
   # closed.  Therefore, sleep for 1 second after a webcam probe.
   if input.input_type == InputType.WEBCAM:
     time.sleep(1)
 
-  return output_string
+  return result
+
+def _get_stream(input: Input,
+                probe_result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+  """Find the metadata for this input's stream in the output of probe().
+
+  Returns an empty dictionary if the stream can't be found.
+  """
+
+  if probe_result is None:
+    return {}
 
+  # Track numbers are per media type, just like FFmpeg's stream specifiers.
+  # See Input.get_stream_specifier().
+  codec_type = CODEC_TYPES[input.media_type]
+  streams = [stream for stream in probe_result.get('streams', [])
+             if stream.get('codec_type') == codec_type]
+  if input.track_num >= len(streams):
+    return {}
+  return streams[input.track_num]
 
-def get_language(input: Input) -> Optional[str]:
+
+def get_language(input: Input,
+                 probe_result: Optional[Dict[str, Any]]) -> Optional[str]:
   """Returns the autodetected the language of the input."""
-  return _probe(input, 'stream_tags=language')
+  stream = _get_stream(input, probe_result)
+  # Fall back to None if the language tag is missing or empty.
+  return stream.get('tags', {}).get('language') or None
 
-def get_interlaced(input: Input) -> bool:
+def get_interlaced(input: Input,
+                   probe_result: Optional[Dict[str, Any]]) -> bool:
   """Returns True if we detect that the input is interlaced."""
-  interlaced_string = _probe(input, 'stream=field_order')
+  interlaced_string = _get_stream(input, probe_result).get('field_order')
 
   # These constants represent the order of the fields (2 fields per frame) of
   # different types of interlaced video.  They can be found in
@@ -96,21 +359,25 @@ def get_interlaced(input: Input) -> bool:
     'bt',
   ]
 
-def get_frame_rate(input: Input) -> Optional[float]:
+def get_frame_rate(input: Input,
+                   probe_result: Optional[Dict[str, Any]]) -> Optional[float]:
   """Returns the autodetected frame rate of the input."""
 
-  frame_rate_string = _probe(input, 'stream=r_frame_rate')
-  if frame_rate_string is None:
+  frame_rate_string = _get_stream(input, probe_result).get('r_frame_rate')
+  if not isinstance(frame_rate_string, str):
     return None
 
   # This string is the framerate in the form of a fraction, such as '24/1' or
   # '30000/1001'.  We must split it into pieces and do the division to get a
-  # float.
-  fraction = frame_rate_string.split('/')
-  if len(fraction) == 1:
-    frame_rate = float(fraction[0])
-  else:
-    frame_rate = float(fraction[0]) / float(fraction[1])
+  # float.  ffprobe reports '0/0' when the frame rate is unknown.
+  try:
+    fraction = frame_rate_string.split('/')
+    if len(fraction) == 1:
+      frame_rate = float(fraction[0])
+    else:
+      frame_rate = float(fraction[0]) / float(fraction[1])
+  except (ValueError, ZeroDivisionError):
+    return None
 
   # The detected frame rate for interlaced content is twice what it should be.
   # It's actually the field rate, where it takes two interlaced fields to make
@@ -122,19 +389,16 @@ def get_frame_rate(input: Input) -> Optional[float]:
 
   return frame_rate
 
-def get_resolution(input: Input) -> Optional[VideoResolutionName]:
+def get_resolution(
+    input: Input,
+    probe_result: Optional[Dict[str, Any]]) -> Optional[VideoResolutionName]:
   """Returns the autodetected resolution of the input."""
 
-  resolution_string = _probe(input, 'stream=width,height')
-  if resolution_string is None:
+  stream = _get_stream(input, probe_result)
+  width, height = stream.get('width'), stream.get('height')
+  if not isinstance(width, int) or not isinstance(height, int):
     return None
 
-  # This is the resolution of the video in the form of 'WIDTH|HEIGHT'.  For
-  # example, '1920|1080'.  We have to split up width and height and match that
-  # to a named resolution.
-  width_string, height_string = resolution_string.split('|')
-  width, height = int(width_string), int(height_string)
-
   for bucket in VideoResolution.sorted_values():
     # The first bucket this fits into is the one.
     if (width <= bucket.max_width and height <= bucket.max_height and
@@ -142,4 +406,3 @@ def get_resolution(input: Input) -> Optional[VideoResolutionName]:
       return bucket.get_key()
 
   return None
-
@@ -271,14 +271,23 @@ class Base(object):
   The base class does the rest.
   """
 
-  def __init__(self, dictionary: Dict[str, Any]) -> None:
-    """Ingests, type-checks, and validates the input dictionary."""
+  _config_fields: Dict[str, Field] = {}
+  """All the config fields for this type, by name.  Collected once per class in
+  __init_subclass__."""
+
+  def __init_subclass__(cls, **kwargs) -> None:
+    super().__init_subclass__(**kwargs)
 
     # Collect all the config fields for this type.
-    config_fields = {}
-    for key, field in self.__class__.__dict__.items():
+    cls._config_fields = {}
+    for key, field in cls.__dict__.items():
       if isinstance(field, Field):
-        config_fields[key] = field
+        cls._config_fields[key] = field
+
+  def __init__(self, dictionary: Dict[str, Any]) -> None:
+    """Ingests, type-checks, and validates the input dictionary."""
+
+    config_fields = self._config_fields
 
     for key, value in dictionary.items():
       field = config_fields.get(key)
@@ -13,12 +13,14 @@
 # limitations under the License.
 
 import enum
+import functools
 import platform
+import shlex
 
 from . import bitrate_configuration
 from . import configuration
 
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 
 class InputType(enum.Enum):
@@ -60,6 +62,45 @@ class MediaType(enum.Enum):
   TEXT = 'text'
 
 
+# The operating system, which determines how webcams are read.
+_SYSTEM = platform.system()
+
+# Maps media types to the stream type used in FFmpeg stream specifiers.
+_STREAM_SPECIFIER_TYPES = {
+  MediaType.VIDEO: 'v',
+  MediaType.AUDIO: 'a',
+  MediaType.TEXT: 's',
+}
+
+# Fields which are not supported with media_type of 'text', because we don't
+# process or transcode it.
+_TEXT_DISALLOWED_FIELDS = ('start_time', 'end_time', 'filters')
+
+# Fields which are only valid with input_type of 'file'.
+_FILE_ONLY_FIELDS = ('start_time', 'end_time')
+
+# Fields which are auto-detected by probing the input, for each media type.
+_AUTODETECTED_FIELDS = {
+  MediaType.VIDEO: ('is_interlaced', 'frame_rate', 'resolution'),
+  MediaType.AUDIO: ('language',),
+  MediaType.TEXT: ('language',),
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _split_args(args: str) -> Tuple[str, ...]:
+  """Parse a string of arguments using shell quoting rules.
+
+  Many inputs share the same extra_input_args (most often none at all), so the
+  results are cached.  A tuple is returned so that the cached value can't be
+  modified.
+  """
+
+  if not args:
+    return ()
+  return tuple(shlex.split(args))
+
+
 class Input(configuration.Base):
   """An object representing a single input stream to Shaka Streamer."""
 
@@ -146,6 +187,18 @@ class Input(configuration.Base):
   Otherwise, it will default to 'und' (undetermined).
   """
 
+  probe_metadata = configuration.Field(bool, default=True).cast()
+  """True if missing fields may be auto-detected by probing the input.
+
+  If false, the input is never probed.  Video inputs must then specify
+  frame_rate and resolution, is_interlaced will default to False, and language
+  will default to 'und' (undetermined).
+
+  Inputs are only probed when at least one auto-detectable field is missing,
+  so this is only needed to avoid probing inputs where that would fail or be
+  expensive.
+  """
+
   start_time = configuration.Field(str).cast()
   """The start time of the slice of the input to use.
 
@@ -177,41 +230,55 @@ class Input(configuration.Base):
   def __init__(self, *args) -> None:
     super().__init__(*args)
 
-    # FIXME: A late import to avoid circular dependency issues between these two
-    # modules.
-    from . import autodetect
+    # These depend only on fields which never change after this point, so
+    # compute them once.  The input args are also needed to probe the input
+    # below.
+    self._stream_specifier: str = '{}:{}'.format(
+        _STREAM_SPECIFIER_TYPES[self.media_type], self.track_num)
+    self._input_args: Tuple[str, ...] = tuple(self._compute_input_args())
+
+    cls = self.__class__
 
     def require_field(name: str) -> None:
       """Raise MissingRequiredField if the named field is still missing."""
       if getattr(self, name) is None:
         raise configuration.MissingRequiredField(
-            self.__class__, name, getattr(self.__class__, name))
+            cls, name, getattr(cls, name))
 
     def disallow_field(name: str, reason: str) -> None:
       """Raise MalformedField if the named field is present."""
       if getattr(self, name):
         raise configuration.MalformedField(
-            self.__class__, name, getattr(self.__class__, name), reason)
+            cls, name, getattr(cls, name), reason)
+
+    # Probe the input only if we need to auto-detect something, and then only
+    # once, sharing the results between all the fields auto-detected below.
+    # InputConfig follows the same rules to prefetch these probes.
+    probe_result: Optional[Dict[str, Any]] = None
+    if self.probe_metadata and any(
+        getattr(self, name) is None
+        for name in _AUTODETECTED_FIELDS[self.media_type]):
+      probe_result = autodetect.probe(self)
 
     if self.media_type == MediaType.VIDEO:
       # These fields are required for video inputs.
       # We will attempt to auto-detect them if possible.
       if self.is_interlaced is None:
-        self.is_interlaced = autodetect.get_interlaced(self)
+        self.is_interlaced = autodetect.get_interlaced(self, probe_result)
 
       if self.frame_rate is None:
-        self.frame_rate = autodetect.get_frame_rate(self)
+        self.frame_rate = autodetect.get_frame_rate(self, probe_result)
       require_field('frame_rate')
 
       if self.resolution is None:
-        self.resolution = autodetect.get_resolution(self)
+        self.resolution = autodetect.get_resolution(self, probe_result)
       require_field('resolution')
 
     if self.media_type == MediaType.AUDIO or self.media_type == MediaType.TEXT:
       # Language is required for audio and text inputs.
       # We will attempt to auto-detect this.
       if self.language is None:
-        self.language = autodetect.get_language(self) or 'und'
+        self.language = autodetect.get_language(self, probe_result) or 'und'
 
     if self.media_type == MediaType.TEXT:
       # Text streams are only supported in plain file inputs.
@@ -223,15 +290,14 @@ class Input(configuration.Base):
       # These fields are not supported with text, because we don't process or
       # transcode it.
       reason = 'not supported with media_type "text"'
-      disallow_field('start_time', reason)
-      disallow_field('end_time', reason)
-      disallow_field('filters', reason)
+      for name in _TEXT_DISALLOWED_FIELDS:
+        disallow_field(name, reason)
 
     if self.input_type != InputType.FILE:
       # These fields are only valid for file inputs.
       reason = 'only valid when input_type is "file"'
-      disallow_field('start_time', reason)
-      disallow_field('end_time', reason)
+      for name in _FILE_ONLY_FIELDS:
+        disallow_field(name, reason)
 
     # A path to a pipe into which this input's contents are fed.
     # None for most input types.
@@ -264,14 +330,7 @@ class Input(configuration.Base):
     See also http://ffmpeg.org/ffmpeg.html#Stream-specifiers
     """
 
-    if self.media_type == MediaType.VIDEO:
-      return 'v:{}'.format(self.track_num)
-    elif self.media_type == MediaType.AUDIO:
-      return 'a:{}'.format(self.track_num)
-    elif self.media_type == MediaType.TEXT:
-      return 's:{}'.format(self.track_num)
-
-    assert False, 'Unrecognized media_type!  This should not happen.'
+    return self._stream_specifier
 
   def get_input_args(self) -> List[str]:
     """Get any required input arguments for this input.
@@ -283,14 +342,20 @@ class Input(configuration.Base):
     Note that for types which support autodetect, these arguments must be
     understood by ffprobe as well as ffmpeg.
     """
+
+    return list(self._input_args)
+
+  def _compute_input_args(self) -> List[str]:
+    """Compute the return value of get_input_args()."""
+
     if self.input_type == InputType.WEBCAM:
-      if platform.system() == 'Linux':
+      if _SYSTEM == 'Linux':
         return [
             # Treat the input as a video4linux device, which is how webcams show
             # up on Linux.
             '-f', 'video4linux2',
         ]
-      elif platform.system() == 'Darwin':  # AKA macOS
+      elif _SYSTEM == 'Darwin':  # AKA macOS
         return [
             # Webcams on macOS use FFmpeg's avfoundation input format.  With
             # this, you also have to specify an input framerate, unfortunately.
@@ -302,6 +367,11 @@ class Input(configuration.Base):
 
     return []
 
+  def get_extra_input_args(self) -> List[str]:
+    """Get extra_input_args, parsed from a string into an argument array."""
+
+    return list(_split_args(self.extra_input_args))
+
   def get_resolution(self) -> bitrate_configuration.VideoResolution:
     return bitrate_configuration.VideoResolution.get_value(self.resolution)
 
@@ -312,3 +382,46 @@ class InputConfig(configuration.Base):
   inputs = configuration.Field(List[Input], required=True).cast()
   """A list of Input objects, one per input stream."""
 
+  def __init__(self, dictionary: Dict[str, Any]) -> None:
+    # Each Input probes its own file as it is constructed, which is dominated by
+    # the startup time of ffprobe.  So first, probe all the files that will need
+    # it in parallel, following the same rules as Input.  Each Input will then
+    # find its results in autodetect's cache.  Malformed inputs are skipped
+    # here, and will be reported by the base class.
+    input_fields = Input._config_fields
+    paths = []
+    input_dicts = dictionary.get('inputs')
+    if not isinstance(input_dicts, list):
+      input_dicts = []
+
+    for input_dict in input_dicts:
+      if not isinstance(input_dict, dict):
+        continue
+
+      try:
+        input_type = InputType(input_dict.get(
+            'input_type', input_fields['input_type'].default))
+        media_type = MediaType(input_dict.get('media_type'))
+      except ValueError:
+        continue
+
+      probe_metadata = input_dict.get(
+          'probe_metadata', input_fields['probe_metadata'].default)
+      if not probe_metadata or input_type not in autodetect.TYPES_WE_CAN_CACHE:
+        continue
+
+      if all(input_dict.get(name) is not None
+             for name in _AUTODETECTED_FIELDS[media_type]):
+        continue
+
+      if isinstance(input_dict.get('name'), str):
+        paths.append(input_dict['name'])
+
+    autodetect.prefetch(paths)
+
+    super().__init__(dictionary)
+
+
+# The autodetect module depends on the classes above, so it is imported once
+# they are defined, rather than at the top of this module.
+from . import autodetect
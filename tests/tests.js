@@ -209,6 +209,20 @@ function errorTests() {
         }));
   });
 
+  it('fails when probe_metadata is false and fields are missing', async () => {
+    const inputConfig = getBasicInputConfig();
+    // This input could be autodetected, but probing is disabled.
+    inputConfig.inputs[0].probe_metadata = false;
+    inputConfig.inputs[0].resolution = '1080p';
+    // frame_rate is required, but missing.
+
+    await expectAsync(startStreamer(inputConfig, minimalPipelineConfig))
+        .toBeRejectedWith(jasmine.objectContaining({
+          error_type: 'MissingRequiredField',
+          field_name: 'frame_rate',
+        }));
+  });
+
   it('fails when frame_rate is not a number', async () => {
     const inputConfig = getBasicInputConfig();
     inputConfig.inputs[0].frame_rate = '99';
@@ -654,6 +668,32 @@ function languageTests(manifestUrl, format) {
     const lang = trackList.map(track => track.language);
     expect(lang).toEqual(['zh']);
   });
+
+  it('defaults to "und" when probe_metadata is false ' + format,
+      async() => {
+    const inputConfigDict = {
+      'inputs': [
+        {
+          'name': TEST_DIR + 'Sintel.2010.720p.Small.mkv',
+          'media_type': 'audio',
+          // The language would normally be autodetected.
+          'probe_metadata': false,
+          // Keep this test short by only encoding 1s of content.
+          'end_time': '0:01',
+        },
+      ],
+    };
+    const pipelineConfigDict = {
+      'streaming_mode': 'vod',
+      'resolutions': [],
+    };
+    await startStreamer(inputConfigDict, pipelineConfigDict);
+    await player.load(manifestUrl);
+
+    const trackList = player.getVariantTracks();
+    const lang = trackList.map(track => track.language);
+    expect(lang).toEqual(['und']);
+  });
 }
 
 function textTracksTests(manifestUrl, format) {